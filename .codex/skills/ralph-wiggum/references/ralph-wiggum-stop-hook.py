@@ -2,7 +2,6 @@
 
 import json
 import os
-import re
 import sys
 from dataclasses import dataclass
 from typing import Optional
@@ -10,6 +9,23 @@ from typing import Optional
 
 STATE_FILE = os.path.join(".claude", "ralph-loop.local.md")
 
+try:
+    import orjson
+
+    def _loads(data):
+        return orjson.loads(data)
+
+    def _dumps(obj) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+
+except ImportError:
+
+    def _loads(data):
+        return json.loads(data)
+
+    def _dumps(obj) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
 
 @dataclass
 class RalphState:
@@ -24,44 +40,62 @@ def _warn(msg: str) -> None:
 
 
 def _read_hook_input() -> dict:
-    raw = sys.stdin.read()
+    raw = sys.stdin.buffer.read()
     if not raw.strip():
         return {}
     try:
-        return json.loads(raw)
+        return _loads(raw)
     except Exception as exc:  # noqa: BLE001
         _warn(f"⚠️  Ralph loop: invalid hook input JSON ({exc})")
         return {}
 
 
 def _extract_frontmatter(text: str) -> Optional[tuple[str, str]]:
-    lines = text.splitlines()
-    if not lines or lines[0].strip() != "---":
-        return None
-    try:
-        end = next(i for i in range(1, len(lines)) if lines[i].strip() == "---")
-    except StopIteration:
+    first_nl = text.find("\n")
+    if first_nl == -1 or text[:first_nl].strip() != "---":
         return None
-    front = "\n".join(lines[1:end])
-    body = "\n".join(lines[end + 1 :])
-    return front, body
+    end = text.find("\n---\n", first_nl)
+    if end != -1:
+        front = text[first_nl + 1 : end]
+        # Only trust the exact match if it is the FIRST closing delimiter:
+        # with a tolerated delimiter earlier (e.g. "--- " with trailing
+        # whitespace), the exact scan can land on a "---" inside the prompt
+        # body (a markdown rule) and swallow the prompt into the frontmatter.
+        if not any(line.strip() == "---" for line in front.splitlines()):
+            return front, text[end + 5 :]
+    # The state file starts life hand-authored from the SKILL.md template, so
+    # split on the first line that strips to "---" to tolerate delimiters the
+    # exact scan misses (trailing/leading whitespace, no final newline).
+    lines = text.splitlines()
+    for i in range(1, len(lines)):
+        if lines[i].strip() == "---":
+            return "\n".join(lines[1:i]), "\n".join(lines[i + 1 :])
+    return None
+
+
+def _parse_fields(front: str) -> dict[str, str]:
+    fields: dict[str, str] = {}
+    for line in front.splitlines():
+        key, sep, value = line.partition(":")
+        if sep:
+            fields[key.strip()] = value.strip()
+    return fields
 
 
-def _parse_int(front: str, key: str) -> Optional[int]:
-    m = re.search(rf"(?m)^{re.escape(key)}:\s*(\d+)\s*$", front)
-    if not m:
+def _parse_int(fields: dict[str, str], key: str) -> Optional[int]:
+    value = fields.get(key)
+    if value is None or not value.isdigit():
         return None
     try:
-        return int(m.group(1))
+        return int(value)
     except ValueError:
         return None
 
 
-def _parse_str(front: str, key: str) -> Optional[str]:
-    m = re.search(rf"(?m)^{re.escape(key)}:\s*(.+?)\s*$", front)
-    if not m:
+def _parse_str(fields: dict[str, str], key: str) -> Optional[str]:
+    value = fields.get(key)
+    if value is None:
         return None
-    value = m.group(1).strip()
     if value.lower() == "null":
         return None
     if len(value) >= 2 and value[0] == value[-1] == '"':
@@ -93,9 +127,10 @@ def _load_state() -> Optional[RalphState]:
         return None
 
     front, body = fm
-    iteration = _parse_int(front, "iteration")
-    max_iterations = _parse_int(front, "max_iterations")
-    completion_promise = _parse_str(front, "completion_promise")
+    fields = _parse_fields(front)
+    iteration = _parse_int(fields, "iteration")
+    max_iterations = _parse_int(fields, "max_iterations")
+    completion_promise = _parse_str(fields, "completion_promise")
 
     if iteration is None or max_iterations is None:
         _warn("⚠️  Ralph loop: state file corrupted (iteration/max_iterations); stopping loop")
@@ -123,7 +158,7 @@ def _load_state() -> Optional[RalphState]:
 
 
 def _write_state(state: RalphState) -> None:
-    completion = "null" if state.completion_promise is None else json.dumps(state.completion_promise)
+    completion = "null" if state.completion_promise is None else _dumps(state.completion_promise)
     text = (
         "---\n"
         f"iteration: {state.iteration}\n"
@@ -182,7 +217,7 @@ def main() -> int:
         "reason": state.prompt_text,
         "systemMessage": sys_msg,
     }
-    sys.stdout.write(json.dumps(out, ensure_ascii=False))
+    sys.stdout.write(_dumps(out))
     return 0
 
 
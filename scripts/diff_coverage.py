@@ -3,16 +3,32 @@
 from __future__ import annotations
 
 import argparse
+import glob
+import hashlib
+import heapq
+import mmap
+import os
+import pickle
+import re
 import subprocess
 import sys
-from collections.abc import Iterable
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
+from functools import lru_cache, partial
+from itertools import chain
 from pathlib import Path
+from typing import TextIO
 
 
-@dataclass(frozen=True)
-class CoverageHit:
-    hits: int
+# How many missing line numbers to show per file in the summary.
+_MISSING_PREVIEW = 10
+
+# @@ -oldStart,oldLen +newStart,newLen @@
+_HUNK_RE = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)")
+
+# SF:<path> | DA:<line>,<hit>[,<checksum>] | end_of_record
+_LCOV_RECORD_RE = re.compile(rb"(?m)^(?:SF:([^\r\n]*)|DA:(\d+),(-?\d+)|end_of_record)")
 
 
 def main() -> int:
@@ -23,7 +39,7 @@ def main() -> int:
         "--lcov",
         action="append",
         required=True,
-        help="Path to lcov.info (repeatable).",
+        help="Path or glob of lcov.info files (repeatable).",
     )
     parser.add_argument(
         "--threshold",
@@ -42,24 +58,43 @@ def main() -> int:
     args = parser.parse_args()
 
     repo_root = git_repo_root()
-    lcov_paths = [Path(p) for p in args.lcov]
+    lcov_paths: list[Path] = []
+    for pattern in args.lcov:
+        matches = sorted(glob.glob(pattern))
+        if matches:
+            lcov_paths.extend(Path(m) for m in matches)
+        else:
+            lcov_paths.append(Path(pattern))
     for path in lcov_paths:
         if not path.is_file():
             print(f"ERROR: lcov file not found: {path}", file=sys.stderr)
             return 2
 
-    changed_lines = parse_changed_lines(git_diff_u0(args.git_diff_args, cached=False))
+    # Parse coverage first: knowing which files are measurable lets us hand
+    # git a pathspec and skip diff parsing for everything else.
+    coverage_by_file = load_lcov_coverage(lcov_paths, repo_root)
+    covered_paths = set(coverage_by_file)
+
+    diff_streams = [
+        git_diff_u0(args.git_diff_args, cached=False, paths=covered_paths)
+    ]
     if not args.git_diff_args:
-        merge_changed_lines(
-            changed_lines, parse_changed_lines(git_diff_u0(args.git_diff_args, cached=True))
+        diff_streams.append(
+            git_diff_u0(args.git_diff_args, cached=True, paths=covered_paths)
         )
+    changed_lines = parse_changed_lines(
+        chain.from_iterable(diff_streams), measurable_files=covered_paths
+    )
     if not changed_lines:
-        print("No changed lines found in git diff.")
-        return 0
+        # The pathspec scoped the diff to measurable files, so an empty parse
+        # can also mean the diff only touched files the lcov data does not
+        # cover; check cheaply before claiming the diff itself was empty.
+        if git_diff_is_empty(args.git_diff_args):
+            print("No changed lines found in git diff.")
+            return 0
 
-    coverage_by_file = load_lcov_coverage(lcov_paths, repo_root)
     result = compute_diff_coverage(changed_lines, coverage_by_file)
-    print(format_summary(result))
+    write_summary(result)
 
     if result.total_measurable_lines == 0:
         return 0
@@ -73,136 +108,360 @@ def git_repo_root() -> Path:
     return Path(stdout)
 
 
-def git_diff_u0(git_diff_args: list[str] | None, cached: bool) -> str:
-    cmd = ["git", "diff", "--no-color", "-U0"]
+# Above this many measurable files, skip the pathspec rather than risk the
+# OS argv size limit; the parser-side filter still applies.
+_MAX_PATHSPEC = 2000
+
+
+def git_diff_u0(
+    git_diff_args: list[str] | None,
+    cached: bool,
+    paths: set[str] | None = None,
+) -> Iterator[str]:
+    # Deletions never contribute measurable lines and rename/similarity
+    # detection is wasted work here (a moved file's lines simply count as
+    # added), so tell git not to produce either.
+    cmd = [
+        "git",
+        "diff",
+        "--no-color",
+        "-U0",
+        "--diff-filter=AM",
+        "--no-renames",
+        "--ignore-submodules",
+    ]
     if cached:
         cmd.append("--cached")
     if git_diff_args:
+        # User args may end in bare paths (argparse's REMAINDER swallows a
+        # literal "--", so paths can only arrive undelimited); appending our
+        # own "--" pathspec after them would make git parse those paths as
+        # revisions. Only auto-scope the diff when we own the command line.
         cmd.extend(git_diff_args)
-    return subprocess.check_output(cmd, text=True)
+    elif paths and len(paths) <= _MAX_PATHSPEC:
+        # :(top) makes the pathspec repo-root-relative, matching the
+        # coverage map keys regardless of the current directory.
+        cmd.append("--")
+        cmd.extend(f":(top){p}" for p in sorted(paths))
+    # Spawn eagerly (rather than on first iteration) so that when main()
+    # builds both the unstaged and cached streams, the two git processes run
+    # concurrently while the first one is being parsed.
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    return _popen_lines(proc, cmd)
+
+
+def git_diff_is_empty(git_diff_args: list[str] | None) -> bool:
+    cmd = [
+        "git",
+        "diff",
+        "--name-only",
+        "--diff-filter=AM",
+        "--no-renames",
+        "--ignore-submodules",
+    ]
+    if git_diff_args:
+        return not subprocess.check_output(cmd + git_diff_args, text=True).strip()
+    if subprocess.check_output(cmd, text=True).strip():
+        return False
+    return not subprocess.check_output(cmd + ["--cached"], text=True).strip()
+
+
+def _popen_lines(proc: subprocess.Popen[str], cmd: list[str]) -> Iterator[str]:
+    with proc:
+        assert proc.stdout is not None
+        for line in proc.stdout:
+            yield line.rstrip("\n")
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
 
 
-def parse_changed_lines(diff_text: str) -> dict[str, set[int]]:
+def parse_changed_lines(
+    diff_lines: Iterable[str],
+    measurable_files: set[str] | None = None,
+) -> dict[str, set[int]]:
     out: dict[str, set[int]] = {}
     current_file: str | None = None
     new_line_no: int | None = None
 
-    for raw in diff_text.splitlines():
-        if raw.startswith("+++ "):
-            path = raw.removeprefix("+++ ").strip()
+    # Added lines arrive as contiguous runs within a hunk, so instead of one
+    # set.add per line, remember where the current run started and flush it as
+    # a single C-level update(range(...)) when the run ends.
+    run_start: int | None = None
+    run_target: set[int] = set()
+
+    # Two specialized loops: while no measurable file is selected, only a
+    # "+++ " header can matter, so scan for one without the full dispatch;
+    # inside a file, dispatch on the first character of each line (the diff
+    # grammar is fully determined by it) instead of a startswith ladder.
+    it = iter(diff_lines)
+    header_line: str | None = None
+
+    while True:
+        if current_file is None and header_line is None:
+            for raw in it:
+                if raw.startswith("+++ "):
+                    header_line = raw
+                    break
+            else:
+                break
+
+        if header_line is not None:
+            path = header_line.removeprefix("+++ ").strip()
+            header_line = None
+            current_file = None
             if path == "/dev/null":
-                current_file = None
                 continue
             if path.startswith("b/"):
                 path = path[2:]
+            if measurable_files is not None and path not in measurable_files:
+                # Still record the file (with no lines) so an empty result
+                # means "the diff changed nothing", not "nothing the lcov
+                # files could measure" - the summary wording differs.
+                out.setdefault(path, set())
+                continue
             current_file = path
             out.setdefault(current_file, set())
             continue
 
-        if raw.startswith("@@ "):
-            if current_file is None:
-                continue
-            # @@ -oldStart,oldLen +newStart,newLen @@
-            try:
-                header = raw.split("@@")[1].strip()
-                plus = next(part for part in header.split() if part.startswith("+"))
-                plus = plus[1:]
-                start = plus.split(",")[0]
-                new_line_no = int(start)
-            except Exception:
-                new_line_no = None
-            continue
-
-        if current_file is None or new_line_no is None:
-            continue
-        if raw.startswith("+") and not raw.startswith("+++"):
-            out[current_file].add(new_line_no)
-            new_line_no += 1
-        elif raw.startswith("-") and not raw.startswith("---"):
-            continue
-        elif raw.startswith(" "):
-            new_line_no += 1
-        elif raw.startswith("\\"):
-            continue
+        for raw in it:
+            first = raw[:1]
+            if first == "+":
+                if raw.startswith("+++"):
+                    if run_start is not None:
+                        run_target.update(range(run_start, new_line_no))
+                        run_start = None
+                    if raw.startswith("+++ "):
+                        header_line = raw
+                        break
+                    continue
+                if new_line_no is None:
+                    continue
+                if run_start is None:
+                    run_start = new_line_no
+                    run_target = out[current_file]
+                new_line_no += 1
+            elif first == "@":
+                if run_start is not None:
+                    run_target.update(range(run_start, new_line_no))
+                    run_start = None
+                if not raw.startswith("@@ "):
+                    continue
+                m = _HUNK_RE.match(raw)
+                new_line_no = int(m.group(1)) if m else None
+            elif first == " ":
+                if run_start is not None:
+                    run_target.update(range(run_start, new_line_no))
+                    run_start = None
+                if new_line_no is not None:
+                    new_line_no += 1
+            # "-" (deletions) and "\\" markers never advance new-file line
+            # numbers, so they do not break a run of added lines either.
         else:
-            continue
+            break
+
+    if run_start is not None:
+        run_target.update(range(run_start, new_line_no))
 
     return out
 
 
-def merge_changed_lines(
-    target: dict[str, set[int]], other: dict[str, set[int]]
-) -> None:
-    for file_path, lines in other.items():
-        existing = target.get(file_path)
-        if existing is None:
-            target[file_path] = set(lines)
-        else:
-            existing.update(lines)
+# Bump when the shape of parse_lcov_file's result or the cache key scheme
+# changes, so stale pickles from older script versions are never loaded.
+_CACHE_VERSION = 4
+
+# Cap on cached parses kept on disk; lcov content changes on every coverage
+# run, so without pruning the cache directory grows without bound.
+_CACHE_KEEP = 32
+
+
+def _prune_cache(cache_dir: Path) -> None:
+    suffix = f"-v{_CACHE_VERSION}.pkl"
+    current: list[tuple[int, str]] = []
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if not entry.is_file():
+                continue
+            if not entry.name.endswith(suffix):
+                # Entries from older cache versions (or stray tmp files)
+                # are never read again.
+                try:
+                    os.unlink(entry.path)
+                except OSError:
+                    pass
+                continue
+            current.append((entry.stat().st_mtime_ns, entry.path))
+    current.sort(reverse=True)
+    for _, stale in current[_CACHE_KEEP:]:
+        try:
+            os.unlink(stale)
+        except OSError:
+            pass
+
+
+def _cache_dir() -> Path:
+    xdg = os.environ.get("XDG_CACHE_HOME")
+    base = Path(xdg) if xdg else Path.home() / ".cache"
+    return base / "diff_coverage"
+
+
+def _file_digest(path: Path) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parse_lcov_file_cached(
+    lcov_path: Path,
+    repo_root: Path,
+) -> dict[str, tuple[set[int], set[int]]]:
+    # The parse depends on repo_root and on which files git tracks there (SF
+    # records resolve through git ls-files), so both are part of the cache
+    # key: a byte-identical lcov artifact must not serve stale path mappings
+    # after a branch switch. Any cache failure falls back to a full parse.
+    try:
+        key = hashlib.blake2b(
+            f"{_file_digest(lcov_path)}:{repo_root}:{_tracked_digest(repo_root)}".encode(),
+            digest_size=16,
+        ).hexdigest()
+        cache_path = _cache_dir() / f"{key}-v{_CACHE_VERSION}.pkl"
+        if cache_path.is_file():
+            with cache_path.open("rb") as f:
+                return pickle.load(f)
+    except Exception:
+        return parse_lcov_file(lcov_path, repo_root)
+
+    result = parse_lcov_file(lcov_path, repo_root)
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cache_path.with_name(f"{cache_path.name}.tmp.{os.getpid()}")
+        with tmp.open("wb") as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_path)
+        _prune_cache(cache_path.parent)
+    except Exception:
+        pass
+    return result
 
 
 def load_lcov_coverage(
     lcov_paths: Iterable[Path],
     repo_root: Path,
-) -> dict[str, dict[int, CoverageHit]]:
-    out: dict[str, dict[int, CoverageHit]] = {}
-    for lcov_path in lcov_paths:
-        for file_path, hits_by_line in parse_lcov_file(lcov_path, repo_root).items():
-            existing = out.setdefault(file_path, {})
-            for lineno, hit in hits_by_line.items():
-                prev = existing.get(lineno)
-                if prev is None:
-                    existing[lineno] = hit
-                else:
-                    existing[lineno] = CoverageHit(hits=prev.hits + hit.hits)
+) -> dict[str, tuple[set[int], set[int]]]:
+    # CI glob expansion can hand us the same artifact more than once (or
+    # byte-identical regenerated copies); parsing one of each is enough,
+    # since merging is a union.
+    unique_paths: list[Path] = []
+    seen_digests: set[str] = set()
+    for path in lcov_paths:
+        digest = _file_digest(path)
+        if digest not in seen_digests:
+            seen_digests.add(digest)
+            unique_paths.append(path)
+    lcov_paths = unique_paths
+
+    if len(lcov_paths) > 1:
+        # Parsing independent lcov files is embarrassingly parallel, but cap
+        # the pool at the core count: glob expansion can hand us dozens of
+        # sharded lcov files, and a worker per file would fork that many
+        # interpreters.
+        workers = min(len(lcov_paths), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parsed = list(
+                executor.map(
+                    partial(parse_lcov_file_cached, repo_root=repo_root), lcov_paths
+                )
+            )
+    else:
+        parsed = [parse_lcov_file_cached(path, repo_root) for path in lcov_paths]
+
+    out: dict[str, tuple[set[int], set[int]]] = {}
+    for per_file in parsed:
+        for file_path, (covered_set, uncovered_set) in per_file.items():
+            existing_covered, existing_uncovered = out.setdefault(
+                file_path, (set(), set())
+            )
+            existing_covered.update(covered_set)
+            existing_uncovered.update(uncovered_set)
+    # A line is covered if any lcov recorded a hit for it, mirroring the
+    # previous sum-across-files semantics.
+    for covered_set, uncovered_set in out.values():
+        uncovered_set -= covered_set
     return out
 
 
 def parse_lcov_file(
     lcov_path: Path,
     repo_root: Path,
-) -> dict[str, dict[int, CoverageHit]]:
-    out: dict[str, dict[int, CoverageHit]] = {}
-    current_file: str | None = None
+) -> dict[str, tuple[set[int], set[int]]]:
+    out: dict[str, tuple[set[int], set[int]]] = {}
+    current: tuple[set[int], set[int]] | None = None
+
+    with open(lcov_path, "rb") as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Zero-length files cannot be mapped (and contain no records).
+            return out
+        with data:
+            for m in _LCOV_RECORD_RE.finditer(data):
+                da_line = m.group(2)
+                if da_line is not None:
+                    if current is not None:
+                        current[0 if int(m.group(3)) > 0 else 1].add(int(da_line))
+                    continue
+                sf = m.group(1)
+                if sf is not None:
+                    resolved = resolve_sf_path(
+                        sf.decode("utf-8", errors="replace").strip(), lcov_path, repo_root
+                    )
+                    if resolved is None:
+                        current = None
+                        continue
+                    current = out.setdefault(resolved, (set(), set()))
+                    continue
+                # end_of_record
+                current = None
 
-    for raw in lcov_path.read_text(encoding="utf-8", errors="replace").splitlines():
-        line = raw.strip()
-        if line.startswith("SF:"):
-            sf = line.removeprefix("SF:").strip()
-            resolved = resolve_sf_path(sf, lcov_path, repo_root)
-            if resolved is None:
-                current_file = None
-                continue
-            current_file = resolved
-            out.setdefault(current_file, {})
-            continue
+    return out
 
-        if line.startswith("DA:") and current_file is not None:
-            # DA:<line>,<hit>[,<checksum>]
-            payload = line.removeprefix("DA:")
-            parts = payload.split(",")
-            if len(parts) < 2:
-                continue
-            try:
-                lineno = int(parts[0])
-                hits = int(parts[1])
-            except ValueError:
-                continue
-            out[current_file][lineno] = CoverageHit(hits=hits)
-            continue
 
-        if line == "end_of_record":
-            current_file = None
+@lru_cache(maxsize=1)
+def _tracked_files(repo_root: Path) -> frozenset[str]:
+    try:
+        output = subprocess.check_output(
+            ["git", "-C", str(repo_root), "ls-files", "-z"], text=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return frozenset()
+    return frozenset(name for name in output.split("\0") if name)
 
-    return out
+
+@lru_cache(maxsize=1)
+def _tracked_digest(repo_root: Path) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for name in sorted(_tracked_files(repo_root)):
+        digest.update(name.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
 
 
+# Many SF records across (and within) lcov files name the same sources;
+# memoizing makes the repeats dict hits, and interning the returned paths
+# de-duplicates the key strings that the merged coverage maps share.
+@lru_cache(maxsize=None)
 def resolve_sf_path(sf: str, lcov_path: Path, repo_root: Path) -> str | None:
     sf_path = Path(sf)
     candidates: list[Path] = []
     if sf_path.is_absolute():
         candidates.append(sf_path)
     else:
+        # One git ls-files subprocess answers the common repo-relative case
+        # for every SF record without a stat per candidate.
+        rel = sf_path.as_posix()
+        if rel in _tracked_files(repo_root):
+            return sys.intern(rel)
         candidates.append(repo_root / sf_path)
         candidates.append(lcov_path.parent / sf_path)
         if lcov_path.parent.parent != lcov_path.parent:
@@ -217,9 +476,9 @@ def resolve_sf_path(sf: str, lcov_path: Path, repo_root: Path) -> str | None:
         return None
 
     try:
-        return resolved.relative_to(repo_root).as_posix()
+        return sys.intern(resolved.relative_to(repo_root).as_posix())
     except ValueError:
-        return resolved.as_posix()
+        return sys.intern(resolved.as_posix())
 
 
 @dataclass(frozen=True)
@@ -227,7 +486,8 @@ class DiffCoverageResult:
     total_measurable_lines: int
     covered_lines: int
     per_file: dict[str, tuple[int, int]]  # file -> (covered, total)
-    missing_by_file: dict[str, list[int]]
+    # file -> (first missing lines, count of further missing lines)
+    missing_by_file: dict[str, tuple[list[int], int]]
 
     @property
     def percent(self) -> float:
@@ -238,35 +498,33 @@ class DiffCoverageResult:
 
 def compute_diff_coverage(
     changed_lines: dict[str, set[int]],
-    coverage_by_file: dict[str, dict[int, CoverageHit]],
+    coverage_by_file: dict[str, tuple[set[int], set[int]]],
 ) -> DiffCoverageResult:
     total = 0
     covered = 0
     per_file: dict[str, tuple[int, int]] = {}
-    missing_by_file: dict[str, list[int]] = {}
+    missing_by_file: dict[str, tuple[list[int], int]] = {}
 
     for file_path, lines in sorted(changed_lines.items()):
-        hits_by_line = coverage_by_file.get(file_path)
-        if not hits_by_line:
+        file_sets = coverage_by_file.get(file_path)
+        if file_sets is None:
             continue
-
-        file_total = 0
-        file_covered = 0
-        missing: list[int] = []
-        for line_no in sorted(lines):
-            hit = hits_by_line.get(line_no)
-            if hit is None:
-                continue
-            file_total += 1
-            if hit.hits > 0:
-                file_covered += 1
-            else:
-                missing.append(line_no)
-
+        covered_set, uncovered_set = file_sets
+
+        # Two C-level intersections replace the per-line dict probes and
+        # hit-count branches; most changed lines (blanks, comments) fall out
+        # of both sets at once.
+        file_covered = len(lines & covered_set)
+        missed_lines = lines & uncovered_set
+        file_total = file_covered + len(missed_lines)
         if file_total == 0:
             continue
+
         per_file[file_path] = (file_covered, file_total)
-        missing_by_file[file_path] = missing
+        # Only the first few missing lines are ever shown; keep that preview
+        # plus a count instead of sorting and storing the whole set.
+        preview = heapq.nsmallest(_MISSING_PREVIEW, missed_lines)
+        missing_by_file[file_path] = (preview, len(missed_lines) - len(preview))
         total += file_total
         covered += file_covered
 
@@ -278,28 +536,24 @@ def compute_diff_coverage(
     )
 
 
-def format_summary(result: DiffCoverageResult) -> str:
-    lines: list[str] = []
-    lines.append(
-        f"Diff coverage: {result.covered_lines}/{result.total_measurable_lines} = {result.percent:.2f}%"
+def write_summary(result: DiffCoverageResult, out: TextIO = sys.stdout) -> None:
+    out.write(
+        f"Diff coverage: {result.covered_lines}/{result.total_measurable_lines} = {result.percent:.2f}%\n"
     )
     if not result.per_file:
-        lines.append("No measurable changed lines were found in the provided lcov files.")
-        return "\n".join(lines)
+        out.write("No measurable changed lines were found in the provided lcov files.\n")
+        return
 
-    lines.append("")
-    lines.append("Per-file:")
+    out.write("\nPer-file:\n")
     for file_path, (covered, total) in result.per_file.items():
         pct = 100.0 if total == 0 else covered * 100.0 / total
         suffix = ""
-        missing = result.missing_by_file.get(file_path) or []
-        if missing:
-            preview = ", ".join(str(n) for n in missing[:10])
-            extra = "" if len(missing) <= 10 else f", +{len(missing) - 10} more"
-            suffix = f" (missing: {preview}{extra})"
-        lines.append(f"  {file_path}: {covered}/{total} = {pct:.2f}%{suffix}")
-
-    return "\n".join(lines)
+        preview, extra_count = result.missing_by_file.get(file_path) or ([], 0)
+        if preview:
+            shown = ", ".join(str(n) for n in preview)
+            extra = f", +{extra_count} more" if extra_count else ""
+            suffix = f" (missing: {shown}{extra})"
+        out.write(f"  {file_path}: {covered}/{total} = {pct:.2f}%{suffix}\n")
 
 
 if __name__ == "__main__":